@@ -1,13 +1,28 @@
 import os
+import sys
+import re
+import asyncio
+import atexit
 import sqlite3
 import time
 import secrets
+from contextlib import contextmanager
+import csv
+import io
+import queue
+import threading
 import requests
-from urllib.parse import urlencode
-from werkzeug.utils import secure_filename
-from flask import Flask, render_template, request, redirect, url_for, flash
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, Request, render_template, request, redirect, url_for, flash
 from dotenv import load_dotenv
 import base64, mimetypes
+import copy
+try:
+    import pybase64 as _b64  # encode/decode SIMD, API sama dengan base64
+except ImportError:
+    _b64 = base64
+import functools, hashlib, json
 
 # Email
 import smtplib, ssl
@@ -31,12 +46,30 @@ SENDER_NAME  = os.getenv("SENDER_NAME", "No-Reply")
 REPLY_TO     = os.getenv("REPLY_TO", "")
 BASE_URL     = (os.getenv("BASE_URL", "https://broadcast-email.up.railway.app")).rstrip("/")
 BATCH_DELAY_SEC = float(os.getenv("BATCH_DELAY_SEC", "0.5"))
+# Batas kirim provider (email/detik); kosong = 1 / BATCH_DELAY_SEC
+EMAILS_PER_SEC  = float(os.getenv("EMAILS_PER_SEC", "0") or "0")
+SMTP_CONCURRENCY = int(os.getenv("SMTP_CONCURRENCY", "5") or "5")
+SMTP_MAX_RETRIES = int(os.getenv("SMTP_MAX_RETRIES", "4") or "4")
+SMTP_RETRY_MAX_SEC = float(os.getenv("SMTP_RETRY_MAX_SEC", "10") or "10")
+SMTP_TIMEOUT    = float(os.getenv("SMTP_TIMEOUT", "60") or "60")
+# "thread" = SMTPWorkerPool, "async" = aiosmtplib dalam satu event loop
+SMTP_BACKEND    = os.getenv("SMTP_BACKEND", "thread").strip().lower()
 FLASK_SECRET    = os.getenv("FLASK_SECRET", secrets.token_hex(16))
+MAX_UPLOAD_MB   = int(os.getenv("MAX_UPLOAD_MB", "16") or "16")
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = FLASK_SECRET
 PUBLIC_BASE_URL = BASE_URL
 app.config["PREFERRED_URL_SCHEME"] = "https"
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB * 1024 * 1024
+# Batas field form non-file (daftar penerima bisa puluhan ribu alamat)
+app.config["MAX_FORM_MEMORY_SIZE"] = MAX_UPLOAD_MB * 1024 * 1024
+
+# Template email di-compile sekali saat start; render langsung tanpa lookup Flask
+if not app.debug:
+    app.jinja_env.auto_reload = False
+with app.app_context():
+    PROMO_TPL = app.jinja_env.get_template("email_templates/promo.html")
 
 # Cloudinary
 CLOUDINARY_CLOUD_NAME = os.getenv("CLOUDINARY_CLOUD_NAME", "")
@@ -54,14 +87,83 @@ if CLOUDINARY_ENABLED:
         secure=True,
     )
 
+if SMTP_BACKEND == "async":
+    import aiosmtplib
+
 # Database
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+# Pool koneksi SQLite (autocommit) dipakai bersama semua thread; koneksi dibuat
+# saat dibutuhkan sampai DB_POOL_SIZE, PRAGMA per-koneksi cukup diset sekali
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8") or "8")
+_DB_POOL = queue.LifoQueue()
+_DB_CONNS = []
+_DB_CONNS_LOCK = threading.Lock()
+
+def _connect_db():
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-32000")
+    conn.execute("PRAGMA mmap_size=268435456")
     return conn
 
+def _checkout_db():
+    try:
+        return _DB_POOL.get_nowait()
+    except queue.Empty:
+        pass
+    with _DB_CONNS_LOCK:
+        if len(_DB_CONNS) < DB_POOL_SIZE:
+            conn = _connect_db()
+            _DB_CONNS.append(conn)
+            return conn
+    return _DB_POOL.get()
+
+@contextmanager
+def get_db():
+    conn = _checkout_db()
+    try:
+        yield conn
+    finally:
+        _DB_POOL.put(conn)
+
+# Transaksi tulis: BEGIN IMMEDIATE ambil write lock di awal, jadi upgrade
+# read->write tidak bisa gagal SQLITE_BUSY di tengah jalan (busy_timeout berlaku)
+@contextmanager
+def db_transaction():
+    with get_db() as con:
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+            # COMMIT di dalam try: kalau gagal (FULL/IOERR/BUSY) tetap di-rollback,
+            # koneksi tidak kembali ke pool dengan transaksi masih terbuka
+            con.execute("COMMIT")
+        except BaseException:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+
+@atexit.register
+def close_all_db():
+    with _DB_CONNS_LOCK:
+        for conn in _DB_CONNS:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _DB_CONNS.clear()
+        while True:
+            try:
+                _DB_POOL.get_nowait()
+            except queue.Empty:
+                break
+
 def init_db():
     with get_db() as con:
+        # WAL tersimpan di file DB, cukup sekali
+        con.execute("PRAGMA journal_mode=WAL")
+    with db_transaction() as con:
         con.execute(
             """
             CREATE TABLE IF NOT EXISTS subscribers (
@@ -74,76 +176,402 @@ def init_db():
             )
             """
         )
-    print("DB ready at", DB_PATH)
+        # Index covering: query audience cukup baca index (lookup token sudah
+        # ter-cover index UNIQUE(token) karena id = rowid)
+        con.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_sub_active
+            ON subscribers(status, id DESC, email, name, token)
+            WHERE status='active'
+            """
+        )
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS campaigns (
+                id TEXT PRIMARY KEY,
+                subject TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                total INTEGER NOT NULL DEFAULT 0,
+                ok_count INTEGER NOT NULL DEFAULT 0,
+                fail_count INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+            """
+        )
+        # Hasil per penerima ditulis selama kirim (bukan hanya di akhir), jadi
+        # kampanye yang terputus tetap tahu siapa yang sudah menerima
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS campaign_results (
+                campaign_id TEXT NOT NULL,
+                email TEXT NOT NULL,
+                error TEXT,
+                PRIMARY KEY (campaign_id, email)
+            ) WITHOUT ROWID
+            """
+        )
+        # Thread kampanye tidak selamat dari restart/deploy; tandai yang tertinggal
+        # supaya halaman status berhenti refresh (init_db jalan sekali, sebelum fork)
+        con.execute(
+            "UPDATE campaigns SET status='error', error='interrupted', finished_at=CURRENT_TIMESTAMP "
+            "WHERE status IN ('queued', 'sending')"
+        )
+    with get_db() as con:
+        con.execute("ANALYZE subscribers")
+        journal_mode = con.execute("SELECT * FROM pragma_journal_mode").fetchone()[0]
+    # Jangan bawa koneksi terbuka melewati fork gunicorn (preload_app)
+    close_all_db()
+    print("DB ready at", DB_PATH, f"(journal_mode={journal_mode})")
 
 init_db()
 
+# Cache jumlah audience aktif (halaman /) in-process; di-reset setiap subscribe/unsubscribe.
+# TTL membatasi data basi di worker gunicorn lain yang tidak melihat invalidasi.
+# Daftar penerima kampanye tidak di-cache: unsubscribe di worker lain harus langsung berlaku.
+AUDIENCE_CACHE_TTL = float(os.getenv("AUDIENCE_CACHE_TTL", "60") or "60")
+_AUDIENCE_CACHE = {"count": None, "expires": 0.0}
+_AUDIENCE_LOCK = threading.RLock()
+
+def invalidate_audience_cache():
+    with _AUDIENCE_LOCK:
+        _AUDIENCE_CACHE.update(count=None, expires=0.0)
+
+def _expire_audience_cache():
+    now = time.monotonic()
+    if now >= _AUDIENCE_CACHE["expires"]:
+        _AUDIENCE_CACHE.update(count=None, expires=now + AUDIENCE_CACHE_TTL)
+
 def upsert_subscriber(email, name=None):
     email = (email or "").strip().lower()
     if not email:
         return False, "Email Kosong"
     token = secrets.token_urlsafe(24)
-    with get_db() as con:
-        try:
+    try:
+        with db_transaction() as con:
             con.execute(
-                "INSERT OR IGNORE INTO subscribers (email, name, token, status) VALUES (?, ?, ?, 'active')",
+                "INSERT INTO subscribers (email, name, token, status) VALUES (?, ?, ?, 'active') "
+                "ON CONFLICT(email) DO UPDATE SET status='active'",
                 (email, name, token),
             )
-            con.execute("UPDATE subscribers SET status='active' WHERE email=?", (email,))
-            return True, None
-        except sqlite3.Error as e:
-            return False, str(e)
+    except sqlite3.Error as e:
+        return False, str(e)
+    invalidate_audience_cache()
+    return True, None
+
+def upsert_subscribers_bulk(rows):
+    data = []
+    for email, name in rows:
+        email = (email or "").strip().lower()
+        if email:
+            data.append((email, (name or "").strip() or None, secrets.token_urlsafe(24)))
+    if not data:
+        return 0, "Tidak ada email valid"
+    try:
+        with db_transaction() as con:
+            con.executemany(
+                "INSERT INTO subscribers (email, name, token, status) VALUES (?, ?, ?, 'active') "
+                "ON CONFLICT(email) DO UPDATE SET status='active'",
+                data,
+            )
+    except sqlite3.Error as e:
+        return 0, str(e)
+    invalidate_audience_cache()
+    return len(data), None
 
 def unsubscribe_by_token(token):
+    with db_transaction() as con:
+        cur = con.execute("UPDATE subscribers SET status='unsubscribed' WHERE token=?", (token,))
+    if not cur.rowcount:
+        return False
+    invalidate_audience_cache()
+    return True
+
+def get_audience_token_map():
     with get_db() as con:
-        cur = con.execute("SELECT id FROM subscribers WHERE token=? LIMIT 1", (token,))
-        row = cur.fetchone()
-        if not row:
-            return False
-        con.execute("UPDATE subscribers SET status='unsubscribed' WHERE id=?", (row["id"],))
-        return True
+        # LOWER() di SQLite: key sudah lowercase tanpa str.lower() per baris
+        rows = con.execute(
+            "SELECT LOWER(email), token FROM subscribers WHERE status='active'"
+        ).fetchall()
+    return {email: token for email, token in rows}
 
-def get_active_emails():
+# Token tersimpan untuk alamat tertentu (penerima manual yang ternyata subscriber)
+def tokens_for(emails, chunk=500):
+    emails = list(emails)
+    found = {}
     with get_db() as con:
-        cur = con.execute(
-            "SELECT email, name, token FROM subscribers WHERE status='active' ORDER BY id DESC"
+        for i in range(0, len(emails), chunk):
+            part = emails[i:i + chunk]
+            qs = ",".join("?" * len(part))
+            found.update(
+                (row["email"], row["token"])
+                for row in con.execute(
+                    f"SELECT email, token FROM subscribers WHERE email IN ({qs})", part
+                )
+            )
+    return found
+
+def count_active_emails():
+    with _AUDIENCE_LOCK:
+        _expire_audience_cache()
+        if _AUDIENCE_CACHE["count"] is None:
+            with get_db() as con:
+                _AUDIENCE_CACHE["count"] = con.execute(
+                    "SELECT COUNT(*) FROM subscribers WHERE status='active'"
+                ).fetchone()[0]
+        return _AUDIENCE_CACHE["count"]
+
+# Kampanye: status & hasil disimpan di DB supaya bisa dibaca dari worker gunicorn mana pun
+def create_campaign(subject, total):
+    campaign_id = secrets.token_hex(8)
+    with db_transaction() as con:
+        con.execute(
+            "INSERT INTO campaigns (id, subject, total) VALUES (?, ?, ?)",
+            (campaign_id, subject, total),
         )
-        return cur.fetchall()
+    return campaign_id
+
+def update_campaign(campaign_id, **fields):
+    cols = ", ".join(f"{k}=?" for k in fields)
+    with db_transaction() as con:
+        con.execute(f"UPDATE campaigns SET {cols} WHERE id=?", (*fields.values(), campaign_id))
+
+# results: [(email, error atau None)]; ditulis satu transaksi bersama counter
+def _insert_campaign_results(con, campaign_id, results):
+    con.executemany(
+        "INSERT OR REPLACE INTO campaign_results (campaign_id, email, error) VALUES (?, ?, ?)",
+        [(campaign_id, email, err) for email, err in results],
+    )
+
+def record_campaign_results(campaign_id, results, ok_count, fail_count):
+    with db_transaction() as con:
+        _insert_campaign_results(con, campaign_id, results)
+        con.execute(
+            "UPDATE campaigns SET ok_count=?, fail_count=? WHERE id=?",
+            (ok_count, fail_count, campaign_id),
+        )
+
+def finish_campaign(campaign_id, results, ok_count, fail_count, error=None):
+    with db_transaction() as con:
+        _insert_campaign_results(con, campaign_id, results)
+        con.execute(
+            "UPDATE campaigns SET status=?, ok_count=?, fail_count=?, error=?, "
+            "finished_at=CURRENT_TIMESTAMP WHERE id=?",
+            ("error" if error else "done", ok_count, fail_count, error, campaign_id),
+        )
+
+def get_campaign_results(campaign_id):
+    sent_ok, sent_fail = [], []
+    with get_db() as con:
+        for email, err in con.execute(
+            "SELECT email, error FROM campaign_results WHERE campaign_id=? ORDER BY email",
+            (campaign_id,),
+        ):
+            if err is None:
+                sent_ok.append(email)
+            else:
+                sent_fail.append((email, err))
+    return sent_ok, sent_fail
+
+def get_campaign(campaign_id):
+    with get_db() as con:
+        return con.execute("SELECT * FROM campaigns WHERE id=?", (campaign_id,)).fetchone()
 
 # Helpers
-def build_unsub_link(token):
-    return f"{BASE_URL}{url_for('unsubscribe')}?{urlencode({'token': token})}"
+_RE_RECIPIENT_SEP = re.compile(r"[,;\s]+")
+_RE_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+_RE_UNSAFE_FILENAME = re.compile(r"[^A-Za-z0-9_.-]+")
+
+# Placeholder link unsubscribe; template email dirender sekali per kampanye
+UNSUB_PLACEHOLDER = "__UNSUB_LINK__"
+
+def random_tokens(n, nbytes=24):
+    # nbytes kelipatan 3 -> tiap token pas 4*nbytes/3 karakter base64 tanpa padding
+    raw = base64.urlsafe_b64encode(os.urandom(nbytes * n)).decode("ascii")
+    size = nbytes * 4 // 3
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+# Prefix tetap selama proses hidup; url_for cukup sekali (butuh request context)
+@functools.lru_cache(maxsize=1)
+def unsub_link_prefix():
+    return f"{BASE_URL}{url_for('unsubscribe')}?token="
 
 UPLOAD_DIR = os.path.join(BASE_DIR, "static", "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-ALLOWED_EXTS = {"png", "jpg", "jpeg", "gif"}
+ALLOWED_EXTS = (".png", ".jpg", ".jpeg", ".gif")
 def allowed_ext(filename):
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTS
+    return filename.lower().endswith(ALLOWED_EXTS)
+
+def upload_filename(filename):
+    # Setara secure_filename: "/" dan karakter lain jadi "_", titik di depan dibuang
+    clean = _RE_UNSAFE_FILENAME.sub("_", filename).strip("._")
+    name, ext = os.path.splitext(clean)
+    uniq = f"{int(time.time())}_{secrets.token_hex(4)}"
+    return f"{name[:40]}_{uniq}{ext.lower()}"
+
+# File gambar di /upload langsung ditulis ke UPLOAD_DIR saat multipart diparse,
+# tanpa spool dulu ke memori / /tmp. Buffer 1MB menggabungkan chunk kecil parser
+# menjadi write() besar. Selama parse file bernama *.part; upload() yang
+# memindahkannya ke nama final, sisanya dihapus di teardown.
+UPLOAD_WRITE_BUFFER = 1 << 20
+UPLOAD_PART_SUFFIX = ".part"
+
+class UploadRequest(Request):
+    upload_parts = ()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == "upload" and filename and allowed_ext(filename):
+            path = f"{UPLOAD_DIR}/{upload_filename(filename)}{UPLOAD_PART_SUFFIX}"
+            f = open(path, "wb+", buffering=UPLOAD_WRITE_BUFFER)
+            self.upload_parts += (f,)
+            return f
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+app.request_class = UploadRequest
+
+# Hapus file *.part yang tidak dipindahkan (parse gagal, ditolak, error, dsb.)
+@app.teardown_request
+def _cleanup_upload_parts(exc=None):
+    for f in request.upload_parts:
+        f.close()
+        try:
+            os.remove(f.name)
+        except OSError:
+            pass
+
+# Session HTTP bersama (keep-alive + pool koneksi) untuk fetch gambar
+_HTTP = requests.Session()
+_HTTP.headers["Connection"] = "keep-alive"
+_HTTP_ADAPTER = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+)
+_HTTP.mount("https://", _HTTP_ADAPTER)
+_HTTP.mount("http://", _HTTP_ADAPTER)
 
 # Fetch image dari URL untuk embed inline (CID)
+# Hasil di-cache per URL: LRU in-process + file di IMG_CACHE_DIR (dipakai bersama antar worker).
+# Entri lebih tua dari IMG_CACHE_TTL divalidasi ulang (ETag / Last-Modified);
+# file di disk dibatasi IMG_CACHE_MAX_FILES terbaru.
+IMG_CACHE_DIR = os.getenv("IMG_CACHE_DIR", "/tmp/img_cache")
+IMG_CACHE_TTL = max(1, int(os.getenv("IMG_CACHE_TTL", "3600") or "3600"))
+IMG_CACHE_MAX_FILES = int(os.getenv("IMG_CACHE_MAX_FILES", "100") or "100")
+
 def _fetch_image_for_inline(url: str):
     try:
-        head = requests.head(url, timeout=10, allow_redirects=True)
-        if head.status_code == 200 and head.headers.get("Content-Type","").startswith("image/"):
-            ct = head.headers["Content-Type"]
-            get = requests.get(url, timeout=20)
-            if get.status_code == 200 and get.content:
-                b64 = base64.b64encode(get.content).decode("ascii")
-                ext = mimetypes.guess_extension(ct.split(";")[0]) or ".jpg"
-                return {"content": b64, "type": ct, "filename": f"hero{ext}"}
+        path = _local_upload_path(url)
+        if path:
+            return _load_local_image(path, os.path.getmtime(path))
+        return _load_inline_image(url, int(time.time() // IMG_CACHE_TTL))
     except Exception:
+        return None
+
+# URL hasil /upload lokal: baca langsung dari disk, tidak perlu HTTP ke diri sendiri
+def _local_upload_path(url):
+    prefix = f"{PUBLIC_BASE_URL}{app.static_url_path}/uploads/"
+    if not url.startswith(prefix):
+        return None
+    name = url[len(prefix):]
+    if not name or name != os.path.basename(name):
+        return None
+    path = os.path.join(UPLOAD_DIR, name)
+    return path if os.path.isfile(path) else None
+
+# Gambar base64 bisa puluhan MB; simpan sedikit saja per worker
+@functools.lru_cache(maxsize=4)
+def _load_local_image(path, mtime):
+    ct = mimetypes.guess_type(path)[0]
+    if not ct or not ct.startswith("image/"):
+        raise ValueError("Bukan gambar")
+    with open(path, "rb") as f:
+        content = f.read()
+    ext = os.path.splitext(path)[1].lower() or ".jpg"
+    return {"content": _b64.b64encode(content).decode("ascii"), "type": ct, "filename": f"hero{ext}"}
+
+# ttl_bucket hanya bagian key: entri in-process kedaluwarsa tiap IMG_CACHE_TTL
+@functools.lru_cache(maxsize=4)
+def _load_inline_image(url, ttl_bucket):
+    cache_path = os.path.join(IMG_CACHE_DIR, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+    cached = None
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            cached = json.load(f)
+        if time.time() - os.path.getmtime(cache_path) < IMG_CACHE_TTL:
+            return cached
+    except (OSError, ValueError):
         pass
-    return None
 
-# Kirim email via SMTP
-def send_one_email(to_email, subject, html_body, unsub_http_link, attachments=None):
-    if not (SMTP_HOST and SMTP_PORT and SMTP_USER and SMTP_PASS):
-        raise RuntimeError("Konfigurasi SMTP tidak lengkap: isi SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS.")
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    # Satu GET: cek header dulu, body baru dibaca kalau memang gambar
+    with _HTTP.get(url, timeout=20, stream=True, headers=headers) as resp:
+        if cached and resp.status_code == 304:
+            try:
+                os.utime(cache_path)
+            except OSError:
+                pass
+            return cached
+        ct = resp.headers.get("Content-Type", "")
+        if resp.status_code != 200 or not ct.startswith("image/"):
+            raise ValueError("Bukan gambar")
+        content = resp.content
+        etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+    if not content:
+        raise ValueError("Gagal mengambil gambar")
+    b64 = _b64.b64encode(content).decode("ascii")
+    ext = mimetypes.guess_extension(ct.split(";")[0]) or ".jpg"
+    data = {
+        "content": b64, "type": ct, "filename": f"hero{ext}",
+        "etag": etag, "last_modified": last_modified,
+    }
+
+    try:
+        os.makedirs(IMG_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{secrets.token_hex(4)}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    _prune_img_cache()
+    return data
+
+def _prune_img_cache():
+    try:
+        entries = [e for e in os.scandir(IMG_CACHE_DIR) if e.name.endswith(".json")]
+        if len(entries) <= IMG_CACHE_MAX_FILES:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    except OSError:
+        return
+    for e in entries[IMG_CACHE_MAX_FILES:]:
+        try:
+            os.remove(e.path)
+        except OSError:
+            pass
+
+# Gambar di Cloudinary sudah publik + ter-CDN; inline hanya memperbesar tiap email
+CLOUDINARY_URL_PREFIXES = ("https://res.cloudinary.com/",) + (
+    (f"https://{CLOUDINARY_CLOUD_NAME}.cloudinary.com/",) if CLOUDINARY_CLOUD_NAME else ()
+)
 
+def should_inline(url):
+    return bool(url) and not url.startswith(CLOUDINARY_URL_PREFIXES)
+
+# Kirim email via SMTP
+def build_message(to_email, subject, html_body, unsub_http_link, attachments=None):
     msg = EmailMessage()
     msg["From"] = formataddr((SENDER_NAME, SENDER_EMAIL or SMTP_USER))
-    msg["To"] = to_email
+    if to_email:
+        msg["To"] = to_email
     msg["Subject"] = subject
     if REPLY_TO:
         msg["Reply-To"] = REPLY_TO
@@ -157,7 +585,7 @@ def send_one_email(to_email, subject, html_body, unsub_http_link, attachments=No
         for att in attachments:
             ctype = att.get("type", "application/octet-stream")
             maintype, subtype = ctype.split("/", 1)
-            raw = base64.b64decode(att["content"])
+            raw = _b64.b64decode(att["content"])
             filename = att.get("filename", "file")
             cid = att.get("content_id") or att.get("cid")
             if att.get("disposition") == "inline" and cid:
@@ -166,27 +594,330 @@ def send_one_email(to_email, subject, html_body, unsub_http_link, attachments=No
                 )
             else:
                 msg.add_attachment(raw, maintype=maintype, subtype=subtype, filename=filename)
+    return msg
+
+# Salin template pesan kampanye (lampiran sudah ter-encode) lalu isi bagian per penerima
+def message_for_recipient(template, to_email, html_body, unsub_http_link):
+    msg = copy.deepcopy(template)
+    msg.get_body(("html",)).set_content(html_body, subtype="html")
+    msg["To"] = to_email
+    if unsub_http_link:
+        msg["List-Unsubscribe"] = f"<{unsub_http_link}>"
+    return msg
 
-    if SMTP_PORT == 465:
+def connect_smtp(host, port, user, password):
+    if port == 465:
         context = ssl.create_default_context()
-        with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, context=context) as server:
-            server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(msg, from_addr=(SENDER_EMAIL or SMTP_USER), to_addrs=[to_email])
+        server = smtplib.SMTP_SSL(host, port, context=context, timeout=SMTP_TIMEOUT)
     else:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
+        server = smtplib.SMTP(host, port, timeout=SMTP_TIMEOUT)
+        server.ehlo()
+        try:
+            server.starttls()
             server.ehlo()
+        except Exception:
+            pass
+    try:
+        server.login(user, password)
+    except Exception:
+        _close_smtp(server)
+        raise
+    return server
+
+def _close_smtp(server):
+    try:
+        server.quit()
+    except Exception:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+# Kode SMTP sementara (server sibuk / koneksi ditutup): reconnect lalu coba lagi
+TRANSIENT_SMTP_CODES = {421, 450, 451, 452, 454}
+
+def _is_transient_smtp_error(e):
+    if isinstance(e, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(code in TRANSIENT_SMTP_CODES for code, _ in e.recipients.values())
+    if isinstance(e, smtplib.SMTPResponseException):
+        return e.smtp_code in TRANSIENT_SMTP_CODES
+    # SMTPException turunan OSError; sisanya error jaringan (timeout, reset)
+    return isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException)
+
+# Rate limiter token bucket; dipakai bersama oleh semua worker pengirim.
+# Token boleh minus (reservasi), jadi tiap pemanggil tahu persis berapa lama menunggu.
+class TokenBucket:
+    def __init__(self, rate_per_sec, capacity=1):
+        self.rate = float(rate_per_sec)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, n):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self, n=1):
+        wait = self._reserve(n)
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self, n=1):
+        wait = self._reserve(n)
+        if wait:
+            await asyncio.sleep(wait)
+
+def send_rate_limiter():
+    rate = EMAILS_PER_SEC or (1 / BATCH_DELAY_SEC if BATCH_DELAY_SEC > 0 else 0)
+    return TokenBucket(rate) if rate > 0 else None
+
+# Backoff eksponensial untuk error SMTP sementara: 0.5s, 1s, 2s, ... maks SMTP_RETRY_MAX_SEC
+def smtp_retry_delay(attempt):
+    return min(SMTP_RETRY_MAX_SEC, 0.5 * 2 ** attempt)
+
+# Pool thread pengirim; tiap worker memakai satu koneksi SMTP yang persisten
+class SMTPWorkerPool:
+    def __init__(self, size, host, port, user, password, bucket=None, on_result=None):
+        self.host, self.port, self.user, self.password = host, port, user, password
+        self.bucket = bucket
+        self.on_result = on_result
+        self.from_addr = SENDER_EMAIL or user
+        self.sent_ok, self.sent_fail = [], []
+        # Antrian dibatasi: submit() menunggu worker, pesan tidak dibangun semua di memori
+        self._queue = queue.Queue(maxsize=2 * max(1, size))
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._worker, daemon=True) for _ in range(max(1, size))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, to_email, msg):
+        self._queue.put((to_email, msg))
+
+    def join(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        return self.sent_ok, self.sent_fail
+
+    def _worker(self):
+        server = None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            to_email, msg = item
+            if self.bucket is not None:
+                self.bucket.acquire()
+            server, err = self._deliver(server, to_email, msg)
+            with self._lock:
+                if err is None:
+                    self.sent_ok.append(to_email)
+                else:
+                    self.sent_fail.append((to_email, err))
+            if self.on_result is not None:
+                self.on_result(to_email, err)
+        if server is not None:
+            _close_smtp(server)
+
+    def _deliver(self, server, to_email, msg):
+        for attempt in range(SMTP_MAX_RETRIES + 1):
             try:
-                server.starttls()
-                server.ehlo()
-            except Exception:
-                pass
-            server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(msg, from_addr=(SENDER_EMAIL or SMTP_USER), to_addrs=[to_email])
+                if server is None:
+                    server = connect_smtp(self.host, self.port, self.user, self.password)
+                server.send_message(msg, from_addr=self.from_addr, to_addrs=[to_email])
+                return server, None
+            except Exception as e:
+                transient = _is_transient_smtp_error(e)
+                if transient and server is not None:
+                    _close_smtp(server)
+                    server = None
+                if not transient or attempt == SMTP_MAX_RETRIES:
+                    return server, str(e)
+                time.sleep(smtp_retry_delay(attempt))
+
+# Backend async: K koneksi aiosmtplib, tiap koneksi menarik pesan dari iterator yang sama
+def _is_transient_async_smtp_error(e):
+    if isinstance(e, (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError,
+                      aiosmtplib.SMTPTimeoutError)):
+        return True
+    if isinstance(e, aiosmtplib.SMTPRecipientsRefused):
+        return all(r.code in TRANSIENT_SMTP_CODES for r in e.recipients)
+    if isinstance(e, aiosmtplib.SMTPResponseException):
+        return e.code in TRANSIENT_SMTP_CODES
+    return isinstance(e, OSError)
+
+async def _connect_smtp_async(host, port, user, password):
+    client = aiosmtplib.SMTP(hostname=host, port=port, use_tls=(port == 465), timeout=SMTP_TIMEOUT)
+    await client.connect()
+    try:
+        await client.login(user, password)
+    except Exception:
+        client.close()
+        raise
+    return client
+
+async def _close_smtp_async(client):
+    try:
+        await client.quit()
+    except Exception:
+        client.close()
+
+async def send_all_async(outbox, size, host, port, user, password, bucket=None, on_result=None):
+    from_addr = SENDER_EMAIL or user
+    sent_ok, sent_fail = [], []
+    outbox = iter(outbox)
+
+    async def worker():
+        client = None
+        try:
+            for to_email, msg in outbox:
+                if bucket is not None:
+                    await bucket.acquire_async()
+                for attempt in range(SMTP_MAX_RETRIES + 1):
+                    try:
+                        if client is None:
+                            client = await _connect_smtp_async(host, port, user, password)
+                        await client.send_message(msg, sender=from_addr, recipients=[to_email])
+                        sent_ok.append(to_email)
+                        err = None
+                        break
+                    except Exception as e:
+                        transient = _is_transient_async_smtp_error(e)
+                        if transient and client is not None:
+                            client.close()
+                            client = None
+                        if not transient or attempt == SMTP_MAX_RETRIES:
+                            err = str(e)
+                            sent_fail.append((to_email, err))
+                            break
+                        await asyncio.sleep(smtp_retry_delay(attempt))
+                if on_result is not None:
+                    # on_result menulis progres ke SQLite (bisa menunggu busy_timeout);
+                    # jalankan di thread supaya event loop dan koneksi lain tidak ikut berhenti
+                    await asyncio.to_thread(on_result, to_email, err)
+        finally:
+            if client is not None:
+                await _close_smtp_async(client)
+
+    # Worker yang gagal (mis. outbox error) tidak membatalkan yang lain;
+    # hasil parsial tetap dikembalikan bersama error pertama
+    results = await asyncio.gather(*(worker() for _ in range(max(1, size))), return_exceptions=True)
+    error = next((str(r) for r in results if isinstance(r, BaseException)), None)
+    return sent_ok, sent_fail, error
+
+# Kampanye dikirim di thread background; request /send langsung kembali
+def run_campaign(campaign_id, subject, raw_body, image_src, inline_requested,
+                 recipients, token_map, invalid, unsub_prefix):
+    progress = {"ok": 0, "fail": len(invalid), "last": 0.0, "flushing": False}
+    progress_lock = threading.Lock()
+    # Hasil yang belum tersimpan; di-flush ke campaign_results maks. sekali per detik
+    pending = [(e, "Format email tidak valid") for e in invalid]
+
+    def on_result(to_email, err):
+        with progress_lock:
+            progress["ok" if err is None else "fail"] += 1
+            pending.append((to_email, err))
+            now = time.monotonic()
+            if progress["flushing"] or now - progress["last"] < 1:
+                return
+            progress["last"] = now
+            progress["flushing"] = True
+            batch, ok, fail = pending[:], progress["ok"], progress["fail"]
+        # Tulis di luar lock: selama SQLite menunggu write lock, hanya worker ini
+        # yang tertahan. Error DB tidak boleh mematikan worker; batch tetap di
+        # pending dan ikut flush berikutnya.
+        saved = False
+        try:
+            record_campaign_results(campaign_id, batch, ok, fail)
+            saved = True
+        except sqlite3.Error as e:
+            print("Gagal update progres kampanye", campaign_id, e, file=sys.stderr)
+        with progress_lock:
+            if saved:
+                del pending[:len(batch)]
+            progress["flushing"] = False
+
+    error = None
+    try:
+        update_campaign(campaign_id, status="sending", fail_count=len(invalid))
+
+        # Default: gambar dimuat dari URL publik; inline (CID) hanya kalau diminta
+        inline_cache = (
+            _fetch_image_for_inline(image_src)
+            if image_src and inline_requested and should_inline(image_src) else None
+        )
+        cid_id = "heroimg"
+
+        attachments = None
+        if inline_cache:
+            attachments = [{
+                "content": inline_cache["content"],
+                "type": inline_cache["type"],
+                "filename": inline_cache["filename"],
+                "disposition": "inline",
+                "content_id": cid_id,
+            }]
+
+        # Render template sekali, lalu ganti placeholder per penerima
+        html_tpl = PROMO_TPL.render(
+            body_html=raw_body,
+            unsub_link=UNSUB_PLACEHOLDER,
+            image_src=(f"cid:{cid_id}" if inline_cache else image_src)
+        )
+
+        # Penerima di luar audience: pakai token tersimpan kalau ada, sisanya
+        # token acak dibuat sekaligus (satu panggilan urandom)
+        missing = [e for e in recipients if e not in token_map]
+        extra_tokens = tokens_for(missing) if missing else {}
+        missing = [e for e in missing if e not in extra_tokens]
+        extra_tokens.update(zip(missing, random_tokens(len(missing))))
+
+        msg_template = build_message(None, subject, html_tpl, None, attachments)
+
+        def outbox():
+            for to_email in recipients:
+                token = token_map.get(to_email) or extra_tokens[to_email]
+                # Token selalu URL-safe (token_urlsafe / random_tokens), tidak perlu di-quote
+                unsub_link = unsub_prefix + token
+                html = html_tpl.replace(UNSUB_PLACEHOLDER, unsub_link)
+                yield to_email, message_for_recipient(msg_template, to_email, html, unsub_link)
+
+        concurrency = min(SMTP_CONCURRENCY, len(recipients))
+        bucket = send_rate_limiter()
+        if SMTP_BACKEND == "async":
+            _, _, error = asyncio.run(send_all_async(
+                outbox(), concurrency, SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, bucket, on_result
+            ))
+        else:
+            pool = SMTPWorkerPool(
+                concurrency, SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, bucket, on_result
+            )
+            # join() juga saat outbox error: worker berhenti, koneksi SMTP ditutup,
+            # dan hasil yang sudah terkirim tetap tercatat lewat on_result
+            try:
+                for to_email, msg in outbox():
+                    pool.submit(to_email, msg)
+            finally:
+                pool.join()
+    except Exception as e:
+        error = str(e)
+    with progress_lock:
+        finish_campaign(campaign_id, pending, progress["ok"], progress["fail"], error=error)
 
 # Routes
 @app.get("/")
 def index():
-    active_count = len(get_active_emails())
+    active_count = count_active_emails()
     return render_template(
         "index.html",
         active_count=active_count,
@@ -213,6 +944,27 @@ def subscribe_submit():
     flash("Berhasil subscribe / diperbarui", "success")
     return redirect(url_for("subscribe_form"))
 
+@app.post("/subscribe/bulk")
+def subscribe_bulk():
+    file = request.files.get("csv")
+    if file and file.filename:
+        text = file.read().decode("utf-8-sig", errors="replace")
+    else:
+        text = request.form.get("emails", "")
+
+    rows = []
+    for rec in csv.reader(io.StringIO(text)):
+        if not rec or "@" not in rec[0]:
+            continue  # baris kosong / header
+        rows.append((rec[0], rec[1] if len(rec) > 1 else None))
+
+    count, err = upsert_subscribers_bulk(rows)
+    if err:
+        flash(f"Gagal: {err}", "error")
+    else:
+        flash(f"Berhasil import {count} subscriber", "success")
+    return redirect(url_for("subscribe_form"))
+
 @app.get("/unsubscribe")
 def unsubscribe():
     token = request.args.get("token", "")
@@ -236,24 +988,25 @@ def send_route():
     if not SENDER_EMAIL:
         flash("Gagal: SENDER_EMAIL belum diset.", "error")
         return redirect(url_for("index"))
+    if not (SMTP_HOST and SMTP_PORT and SMTP_USER):
+        flash("Gagal: konfigurasi SMTP tidak lengkap (SMTP_HOST, SMTP_PORT, SMTP_USER).", "error")
+        return redirect(url_for("index"))
 
-    recipients = set()
-    for part in raw_recipients.replace(";", ",").split(","):
-        e = part.strip()
-        if e:
-            recipients.add(e.lower())
+    parts = {p.lower() for p in _RE_RECIPIENT_SEP.split(raw_recipients) if p}
+    recipients = {e for e in parts if _RE_EMAIL.match(e)}
+    invalid = sorted(parts - recipients)
 
-    audience = []
+    token_map = {}
     if use_audience:
-        audience = get_active_emails()
-        for row in audience:
-            recipients.add(row["email"].lower())
+        token_map = get_audience_token_map()
+        recipients.update(token_map)
 
     if mode == "test":
         if not test_email:
             flash("Masukkan alamat 'Test to' dulu.", "error")
             return redirect(url_for("index"))
         recipients = {test_email.lower()}
+        invalid = []
 
     if not recipients:
         flash("Tidak ada penerima.", "error")
@@ -261,47 +1014,30 @@ def send_route():
 
     image_url_form = (request.form.get("image_url") or "").strip()
     image_src = image_url_form if image_url_form else None
+    inline_requested = request.form.get("inline_image") == "on"
 
-    # Cache gambar inline sekali
-    inline_cache = _fetch_image_for_inline(image_src) if image_src else None
-    cid_id = "heroimg"
-
-    sent_ok, sent_fail = [], []
-    token_map = {row["email"].lower(): row["token"] for row in audience}
-
-    for to_email in sorted(recipients):
-        token = token_map.get(to_email, secrets.token_urlsafe(16))
-        unsub_link = build_unsub_link(token)
-
-        attachments = None
-        use_cid = False
-        if inline_cache:
-            attachments = [{
-                "content": inline_cache["content"],
-                "type": inline_cache["type"],
-                "filename": inline_cache["filename"],
-                "disposition": "inline",
-                "content_id": cid_id,
-            }]
-            use_cid = True
-
-        html = render_template(
-            "email_templates/promo.html",
-            body_html=raw_body,
-            unsub_link=unsub_link,
-            image_src=(f"cid:{cid_id}" if use_cid else image_src)
-        )
-
-        try:
-            send_one_email(to_email, subject, html, unsub_link, attachments=attachments)
-            sent_ok.append(to_email)
-        except Exception as e:
-            sent_fail.append((to_email, str(e)))
-
-        time.sleep(BATCH_DELAY_SEC)
+    recipients = tuple(recipients)
+    campaign_id = create_campaign(subject, len(recipients) + len(invalid))
+    threading.Thread(
+        target=run_campaign,
+        args=(campaign_id, subject, raw_body, image_src, inline_requested,
+              recipients, token_map, invalid, unsub_link_prefix()),
+        daemon=True,
+    ).start()
+    return redirect(url_for("campaign_status", campaign_id=campaign_id), code=303)
 
+@app.get("/campaigns/<campaign_id>")
+def campaign_status(campaign_id):
+    campaign = get_campaign(campaign_id)
+    if campaign is None:
+        return render_template("success.html", campaign=None), 404
+    sent_ok, sent_fail = get_campaign_results(campaign_id)
     return render_template(
-        "success.html", subject=subject, sent_ok=sent_ok, sent_fail=sent_fail
+        "success.html",
+        campaign=campaign,
+        subject=campaign["subject"],
+        sent_ok=sent_ok,
+        sent_fail=sent_fail,
     )
 
 @app.post("/upload")
@@ -313,15 +1049,22 @@ def upload():
     if not allowed_ext(file.filename):
         return {"error": "Invalid file type"}, 400
 
+    part = file.stream.name
+    file.close()
+    filename = os.path.basename(part).removesuffix(UPLOAD_PART_SUFFIX)
+    path = os.path.join(UPLOAD_DIR, filename)
+    os.replace(part, path)
+
     if CLOUDINARY_ENABLED:
         try:
-            res = cloudinary.uploader.upload(
-                file,
+            res = cloudinary.uploader.upload_large(
+                path,
                 folder="email-assets",
                 resource_type="image",
                 use_filename=True,
                 unique_filename=True,
                 overwrite=False,
+                chunk_size=6 * 1024 * 1024,
             )
             url = res.get("secure_url")
             if not url:
@@ -329,12 +1072,12 @@ def upload():
             return {"url": url}
         except Exception as e:
             return {"error": f"Cloudinary error: {e}"}, 500
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
-    name, ext = os.path.splitext(secure_filename(file.filename))
-    uniq = f"{int(time.time())}_{secrets.token_hex(4)}"
-    filename = f"{name[:40]}_{uniq}{ext.lower()}"
-    path = os.path.join(UPLOAD_DIR, filename)
-    file.save(path)
     rel = url_for("static", filename=f"uploads/{filename}")
     url = f"{PUBLIC_BASE_URL}{rel}" if PUBLIC_BASE_URL else url_for(
         "static", filename=f"uploads/{filename}", _external=True
@@ -343,5 +1086,15 @@ def upload():
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
-    print(f"Starting Flask on 0.0.0.0:{port}", flush=True)
-    app.run(host="0.0.0.0", port=port)
\ No newline at end of file
+    try:
+        from gunicorn.app.wsgiapp import run
+    except ImportError:  # gunicorn tidak tersedia (mis. Windows): dev server Flask
+        print(f"Starting Flask on 0.0.0.0:{port}", flush=True)
+        app.run(host="0.0.0.0", port=port, threaded=True)
+    else:
+        print(f"Starting gunicorn on 0.0.0.0:{port}", flush=True)
+        sys.argv = [
+            "gunicorn", "--chdir", BASE_DIR,
+            "-c", os.path.join(BASE_DIR, "gunicorn_conf.py"), "app:app",
+        ]
+        sys.exit(run())
\ No newline at end of file
@@ -1,13 +1,14 @@
 import sqlite3
+import sys
 
 con = sqlite3.connect("audience.sqlite3")
 cur = con.cursor()
 cur.execute("SELECT id, email, name, status, created_at FROM subscribers WHERE status='active'")
-rows = cur.fetchall()
 
-for row in rows:
-    print(row)
+# Ambil per 1000 baris, tulis sekaligus (tidak memuat seluruh tabel ke memori)
+while rows := cur.fetchmany(1000):
+    sys.stdout.writelines(f"{row}\n" for row in rows)
 
 con.close()
 
-# Run python cek_subscriber.py
\ No newline at end of file
+# Run python cek_subscriber.py
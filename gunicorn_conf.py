@@ -0,0 +1,16 @@
+import os
+
+# Konfigurasi gunicorn (Procfile / nixpacks: gunicorn -c gunicorn_conf.py app:app)
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Default 2 worker seperti perintah lama (-w 2); cpu_count() di container = core host,
+# dan tiap worker punya cache, pool SQLite, dan thread kampanye sendiri
+workers = int(os.getenv("WEB_CONCURRENCY") or "2")
+threads = int(os.getenv("GUNICORN_THREADS") or "8")
+worker_class = "gthread"
+timeout = 120
+
+# Load app sekali di master (init_db, template, regex) lalu fork ke worker (copy-on-write)
+preload_app = True
+
+# Heartbeat worker di tmpfs, bukan disk
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None